@@ -1,21 +1,32 @@
+import hashlib
 import os
-import re
+import threading
 import uuid
-from datetime import datetime
+from typing import Optional
 
-from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, func, literal, or_, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Bundle, Session, selectinload
 
 import google.generativeai as genai
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 # local imports - adjust to your project structure
-from database import SessionLocal, engine
-from models import Base, User, Consultant, ConsultantPost, Like, Comment, Follower, HealthQuiz
+from database import SessionLocal
+from models import (
+    User, Consultant, ConsultantPost, Like, Comment, Follower, HealthQuiz, TimelineEntry, MediaType,
+    UPLOADS_DIR, MEDIA_KEY_HEX, media_file, media_url_for, utcnow, bump_counter, backfill_timeline, drop_timeline,
+    TIMELINE_BACKFILL,
+)
+from migrate_db import migrate
+from cache import get_consultant, get_follower_count, invalidate_consultant
 from auth import register_user, login_user, get_current_user, logout_user
 
 # -------------------------------
@@ -24,16 +35,35 @@ from auth import register_user, login_user, get_current_user, logout_user
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_MODEL = genai.GenerativeModel(MODEL_NAME)
+
+# Identical prompts (retries, refreshes, demo quizzes) reuse the last answer for 10 min
+GEMINI_CACHE = TTLCache(maxsize=1024, ttl=600)
+_gemini_cache_lock = threading.Lock()  # TTLCache is not thread-safe
 
 # -------------------------------
 # App setup
 # -------------------------------
+# Route handlers are plain `def`: SQLAlchemy sessions, upload writes and the Gemini SDK
+# all block, so FastAPI runs them in its threadpool instead of stalling the event loop.
 app = FastAPI()
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET", "supersecretkey"))
 
-# serve static files (images/videos)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# serve static files (images/videos); behind nginx set SERVE_STATIC=0 and let it
+# serve /static/ with sendfile (see deploy/nginx.conf)
+if os.getenv("SERVE_STATIC", "1") != "0":
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+# compiled templates are cached on disk so restarted workers skip re-parsing them;
+# outside dev, templates are not re-stat'ed on every render
+JINJA_CACHE_DIR = ".jinja_cache"
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("templates"),
+    autoescape=True,
+    bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+    auto_reload=os.getenv("ENV") == "dev",
+))
+templates.env.globals["MediaType"] = MediaType  # templates branch on post.media_type == MediaType.VIDEO
 
 # ----- ROOT ROUTE (redirect to /home or /login) -----
 @app.get("/", response_class=HTMLResponse)
@@ -46,12 +76,15 @@ def root(request: Request):
         return RedirectResponse("/home")
     return RedirectResponse("/login")
 
-# ensure DB tables exist
-Base.metadata.create_all(bind=engine)
+# create missing tables and upgrade an older medi_ai.db in place (a no-op once up to date)
+migrate()
 
 # uploads directory
-UPLOADS_DIR = os.path.join("static", "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".webp"})
+VIDEO_EXTS = frozenset({".mp4", ".mov", ".avi", ".webm", ".mkv"})
+ALLOWED_UPLOAD_EXTS = IMAGE_EXTS | VIDEO_EXTS
 
 # -------------------------------
 # Helpers
@@ -63,30 +96,137 @@ def get_db():
     finally:
         db.close()
 
-def _sanitize_filename(name: str) -> str:
-    # Keep safe filename characters
-    return re.sub(r"[^\w\-_\. ]", "_", name)
+def save_upload(file: UploadFile, data: bytes = None) -> str:
+    """Store an UploadFile under its content hash and return the media key (or None).
 
-def save_upload(file: UploadFile) -> str:
-    """Save an UploadFile into static/uploads and return just the filename (or None)."""
+    Identical uploads share one file. Pass `data` when the caller already read the
+    upload's bytes; they are written as-is.
+    """
     if not file or not getattr(file, "filename", None):
         return None
-    ext = os.path.splitext(file.filename)[1].lower() or ""
-    uniq = datetime.utcnow().strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:6]
-    fname = f"{uniq}{ext}"
-    fname = _sanitize_filename(fname)
-    dest = os.path.join(UPLOADS_DIR, fname)
-    # read bytes from upload
-    file.file.seek(0)
-    with open(dest, "wb") as f:
-        f.write(file.file.read())
-    return fname
-
-def media_url_for(filename: str) -> str:
-    if not filename:
-        return None
-    # used in templates: "/static/uploads/<filename>"
-    return f"static/uploads/{filename}"
+    # the stored name is derived; only a whitelisted extension is kept from the client's name
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in ALLOWED_UPLOAD_EXTS:
+        ext = ""
+    digest = hashlib.sha256()
+    tmp = os.path.join(UPLOADS_DIR, f".{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp, "wb") as f:
+            if data is not None:
+                digest.update(data)
+                f.write(data)
+            else:
+                # hash while streaming to disk in 1 MiB chunks so large videos never sit fully in memory
+                file.file.seek(0)
+                for chunk in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+        key = digest.hexdigest()[:MEDIA_KEY_HEX] + ext
+        dest = media_file(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # same key, same bytes: replacing an existing copy is harmless, and the fresh mtime
+        # keeps gc_media.py off a file that is about to be referenced again
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return key
+
+def media_type_of(filename: str) -> MediaType:
+    return MediaType.VIDEO if os.path.splitext(filename)[1].lower() in VIDEO_EXTS else MediaType.IMAGE
+
+def current_user(request: Request, db: Session = Depends(get_db)) -> Optional[User]:
+    """Logged-in User for this request (or None), looked up at most once per request."""
+    if not hasattr(request.state, "user"):
+        # try both session keys (compat with older file-based code)
+        user_email = request.session.get("user_email") or request.session.get("user")
+        request.state.user = get_current_user(db, user_email) if user_email else None
+    return request.state.user
+
+# revalidate on every view: like/follow/comment redirect back to the page they came from,
+# which must not be served from the browser cache (a matching ETag still costs only a 304)
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+def content_etag(db: Session, request: Request, consultant_id: int = None) -> str:
+    """Cheap version tag for the feed (or one consultant's profile), computed without rendering.
+
+    Row counts catch deletes and max timestamps catch inserts/edits; consultant rows are
+    hashed as-is because profile edits carry no timestamp (a single profile comes from the cache).
+    """
+    posts = select(ConsultantPost.id)
+    consultants = select(Consultant.id, Consultant.name, Consultant.specialization, Consultant.bio, Consultant.media_key)
+    followers = true()
+    if consultant_id is not None:
+        posts = posts.where(ConsultantPost.consultant_id == consultant_id)
+        consultants = consultants.where(Consultant.id == consultant_id)
+        followers = Follower.consultant_id == consultant_id
+    post_ids = posts.scalar_subquery()
+    aggregates = []
+    for model, scope in ((ConsultantPost, ConsultantPost.id.in_(post_ids)),
+                         (Like, Like.post_id.in_(post_ids)),
+                         (Comment, Comment.post_id.in_(post_ids)),
+                         (Follower, followers)):
+        aggregates.append(select(func.count()).select_from(model).where(scope).scalar_subquery())
+        aggregates.append(select(func.max(model.timestamp)).where(scope).scalar_subquery())
+    version = db.execute(select(*aggregates)).one()
+    h = hashlib.blake2b(digest_size=8)
+    h.update(repr((tuple(version), request.session.get("user_id"))).encode("utf-8"))
+    if consultant_id is not None:
+        h.update(repr(get_consultant(db, consultant_id)).encode("utf-8"))
+    else:
+        for row in db.execute(consultants.order_by(Consultant.id)):
+            h.update(repr(tuple(row)).encode("utf-8"))
+    return f'"{h.hexdigest()}"'
+
+def liked_post_ids(db: Session, user_id: Optional[int], post_ids) -> set:
+    """The subset of `post_ids` liked by `user_id`, in one query (empty for anonymous visitors)."""
+    if not user_id or not post_ids:
+        return set()
+    return set(db.scalars(select(Like.post_id).where(Like.user_id == user_id, Like.post_id.in_(post_ids))))
+
+def followed_consultant_ids(db: Session, user_id: Optional[int], consultant_ids) -> set:
+    """The subset of `consultant_ids` followed by `user_id`, in one query."""
+    if not user_id or not consultant_ids:
+        return set()
+    return set(db.scalars(
+        select(Follower.consultant_id).where(Follower.user_id == user_id, Follower.consultant_id.in_(consultant_ids))
+    ))
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response if the client already holds `etag`, else None."""
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL})
+    return None
+
+def _gemini_cache_key(parts) -> str:
+    h = hashlib.blake2b(MODEL_NAME.encode("utf-8"))
+    for part in parts:
+        if isinstance(part, dict):
+            h.update(part.get("mime_type", "").encode("utf-8"))
+            h.update(part["data"])
+        else:
+            h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def generate_text(parts) -> str:
+    """Send `parts` to Gemini and return the response text, cached by prompt + image bytes."""
+    key = _gemini_cache_key(parts)
+    with _gemini_cache_lock:
+        text = GEMINI_CACHE.get(key)
+    if text is not None:
+        return text
+    text = getattr(GEMINI_MODEL.generate_content(parts), "text", "")
+    if text:
+        with _gemini_cache_lock:
+            GEMINI_CACHE[key] = text
+    return text
+
+def insert_ignore(db: Session, model):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect (SQLite / PostgreSQL)."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
+
 
 # -------------------------------
 # health quiz page (GET)
@@ -100,67 +240,52 @@ def health_quiz_form(request: Request):
 # health quiz submit (POST)
 # -------------------------------
 @app.post("/health_quiz", response_class=HTMLResponse)
-async def submit_health_quiz(
+def submit_health_quiz(
     request: Request,
+    background_tasks: BackgroundTasks,
     question_1: str = Form(...),
     question_2: str = Form(...),
     question_3: str = Form(""),
     image: UploadFile = File(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    user: Optional[User] = Depends(current_user)
 ):
-    user_email = request.session.get("user_email") or request.session.get("user")
-    if not user_email:
+    if not user:
         return RedirectResponse("/login", status_code=303)
 
-    user = get_current_user(db, user_email)
-    image_filename = save_upload(image) if image and image.filename else None
+    # read the image once: the same bytes are written to disk and sent to Gemini
+    image_bytes = image.file.read() if image and image.filename else None
+    image_key = save_upload(image, image_bytes) if image_bytes is not None else None
 
     # Save quiz to DB
+    answers = {"q1": question_1, "q2": question_2, "q3": question_3}
     quiz = HealthQuiz(
         user_id=user.id,
-        question_1=question_1,
-        question_2=question_2,
-        question_3=question_3,
-        image_path=image_filename,
-        timestamp=datetime.utcnow()
+        answers=answers,
+        image_key=image_key
     )
     db.add(quiz)
     db.commit()
 
     # Prepare result for display
     result = {
-        "question_1": question_1,
-        "question_2": question_2,
-        "question_3": question_3,
-        "image_path": media_url_for(image_filename) if image_filename else None
+        "answers": answers,
+        "image_path": media_url_for(image_key)
     }
 
     # -------------------------------
-    # AI recommendations
+    # AI recommendations (generated after the response is sent; the page polls for them)
     # -------------------------------
-    recommendations = []
-    try:
-        model = genai.GenerativeModel(MODEL_NAME)
-        prompt = f"""
-        You are a health assistant. Analyze the following quiz answers and provide 3 short recommendations:
-        Q1: {question_1}
-        Q2: {question_2}
-        Q3: {question_3}
-        """
-        if image_filename:
-            image_path = os.path.join(UPLOADS_DIR, image_filename)
-            with open(image_path, "rb") as img_file:
-                response = model.generate_content([
-                    prompt,
-                    {"mime_type": image.content_type, "data": img_file.read()}
-                ])
-        else:
-            response = model.generate_content([prompt])
-
-        text = getattr(response, "text", "")
-        recommendations = [r.strip() for r in text.split("\n") if r.strip()]
-    except Exception as e:
-        recommendations = [f"AI could not generate recommendations: {str(e)}"]
+    prompt = f"""
+    You are a health assistant. Analyze the following quiz answers and provide 3 short recommendations:
+    Q1: {answers["q1"]}
+    Q2: {answers["q2"]}
+    Q3: {answers["q3"]}
+    """
+    parts = [prompt]
+    if image_key:
+        parts.append({"mime_type": image.content_type, "data": image_bytes})
+    background_tasks.add_task(generate_quiz_recommendations, quiz.id, parts)
 
     return templates.TemplateResponse(
         "health_quiz.html",
@@ -169,10 +294,38 @@ async def submit_health_quiz(
             "user": user,
             "message": "Your quiz has been submitted successfully!",
             "result": result,
-            "recommendations": recommendations
+            "quiz_id": quiz.id
         }
     )
 
+def generate_quiz_recommendations(quiz_id: int, parts) -> None:
+    """Background task: ask Gemini about a submitted quiz and store the answer on its row."""
+    try:
+        text = generate_text(parts)
+    except Exception as e:
+        text = f"AI could not generate recommendations: {str(e)}"
+    db = SessionLocal()
+    try:
+        quiz = db.get(HealthQuiz, quiz_id)
+        if quiz:
+            quiz.recommendations = text or ""
+            db.commit()
+    finally:
+        db.close()
+
+# -------------------------------
+# health quiz recommendations (polled by the quiz page)
+# -------------------------------
+@app.get("/health_quiz/{quiz_id}/recommendations")
+def health_quiz_recommendations(quiz_id: int, db: Session = Depends(get_db), user: Optional[User] = Depends(current_user)):
+    quiz = db.get(HealthQuiz, quiz_id)
+    if not quiz or not user or quiz.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    if quiz.recommendations is None:
+        return JSONResponse({"status": "pending", "recommendations": []})
+    recommendations = [r.strip() for r in quiz.recommendations.split("\n") if r.strip()]
+    return JSONResponse({"status": "done", "recommendations": recommendations})
+
 # -------------------------------
 # Auth / user routes
 # -------------------------------
@@ -203,12 +356,7 @@ def signup_user_route(request: Request, email: str = Form(...), password: str =
         return templates.TemplateResponse("signup.html", {"request": request, "error": str(e)})
 
 @app.get("/home", response_class=HTMLResponse)
-def home_page(request: Request, db: Session = Depends(get_db)):
-    # try both session keys (compat with older file-based code)
-    user_email = request.session.get("user_email") or request.session.get("user")
-    user = None
-    if user_email:
-        user = get_current_user(db, user_email)
+def home_page(request: Request, user: Optional[User] = Depends(current_user)):
     return templates.TemplateResponse("home.html", {"request": request, "user": user})
 
 # -------------------------------
@@ -226,14 +374,14 @@ def forgot_password_page(request: Request):
 # Forgot Password (POST)
 # -------------------------------
 @app.post("/forgot-password", response_class=HTMLResponse)
-async def forgot_password_submit(
+def forgot_password_submit(
     request: Request,
     email: str = Form(...),
     db: Session = Depends(get_db)
 ):
 
     # Check if email exists
-    user = db.query(User).filter(User.email == email).first()
+    user = get_current_user(db, email)
 
     if not user:
         return templates.TemplateResponse(
@@ -265,7 +413,7 @@ def consultant_register_form(request: Request):
 
 @app.post("/consultant-register", response_class=HTMLResponse)
 @app.post("/consultant_register", response_class=HTMLResponse)
-async def consultant_register_submit(
+def consultant_register_submit(
     request: Request,
     name: str = Form(...),
     email: str = Form(...),
@@ -275,7 +423,7 @@ async def consultant_register_submit(
     db: Session = Depends(get_db)
 ):
     try:
-        pic_filename = save_upload(media) if media and media.filename else None
+        pic_key = save_upload(media) if media and media.filename else None
 
         # create or update consultant
         consultant = db.query(Consultant).filter_by(email=email).first()
@@ -285,8 +433,8 @@ async def consultant_register_submit(
                 email=email,
                 specialization=specialization,
                 bio=bio,
-                media_path=pic_filename,
-                media_type="image" if pic_filename else None
+                media_key=pic_key,
+                media_type=MediaType.IMAGE if pic_key else None
             )
             db.add(consultant)
             db.commit()
@@ -294,24 +442,16 @@ async def consultant_register_submit(
             consultant.name = name
             consultant.specialization = specialization
             consultant.bio = bio
-            if pic_filename:
-                # remove old file if exists
-                try:
-                    if consultant.media_path:
-                        old_path = os.path.join(UPLOADS_DIR, consultant.media_path)
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                except Exception:
-                    pass
-                consultant.media_path = pic_filename
-                consultant.media_type = "image"
+            if pic_key:
+                consultant.media_key = pic_key
+                consultant.media_type = MediaType.IMAGE
             db.commit()
 
         # keep track in session (for dashboard flow)
         request.session["consultant_id"] = consultant.id
         request.session["consultant_email"] = consultant.email
         # legacy compatibility
-        request.session["consultant"] = {"name": consultant.name, "email": consultant.email, "specialization": consultant.specialization, "profile_pic": consultant.media_path}
+        request.session["consultant"] = {"name": consultant.name, "email": consultant.email, "specialization": consultant.specialization, "profile_pic": consultant.media_key}
 
         return RedirectResponse("/consultant_post", status_code=303)
 
@@ -338,20 +478,17 @@ def consultant_post_page(request: Request, db: Session = Depends(get_db)):
     if not consultant_id:
         return RedirectResponse("/consultant-register")
 
-    consultant = db.query(Consultant).get(consultant_id)
+    consultant = db.get(Consultant, consultant_id)
     posts = db.query(ConsultantPost).filter_by(consultant_id=consultant_id).order_by(ConsultantPost.timestamp.desc()).all()
-    for p in posts:
-        p.likes_count = db.query(Like).filter(Like.post_id == p.id).count()
-        p.comments_count = db.query(Comment).filter(Comment.post_id == p.id).count()
     # pass profile_pic for template compatibility
-    profile_pic = consultant.media_path if consultant and consultant.media_path else None
+    profile_pic = consultant.media_url if consultant else None
     return templates.TemplateResponse("consultant_post.html", {"request": request, "consultant": consultant, "posts": posts, "profile_pic": profile_pic})
 
 # -------------------------------
 # Create a post (DB-backed)
 # -------------------------------
 @app.post("/consultant_post", response_class=HTMLResponse)
-async def consultant_post_submit(
+def consultant_post_submit(
     request: Request,
     content: str = Form(...),
     media: UploadFile = File(None),
@@ -361,17 +498,14 @@ async def consultant_post_submit(
     if not consultant_id:
         return RedirectResponse("/consultant-register")
 
-    filename = save_upload(media) if media and media.filename else None
-    media_type = None
-    if filename:
-        media_type = "video" if os.path.splitext(filename)[1].lower() in [".mp4", ".mov", ".avi", ".webm"] else "image"
+    media_key = save_upload(media) if media and media.filename else None
+    media_type = media_type_of(media_key) if media_key else None
 
     post = ConsultantPost(
         consultant_id=consultant_id,
         content=content,
-        media_path=filename,
-        media_type=media_type,
-        timestamp=datetime.utcnow()
+        media_key=media_key,
+        media_type=media_type
     )
     db.add(post)
     db.commit()
@@ -384,7 +518,7 @@ async def consultant_post_submit(
 # Edit Post (owner only)
 # -------------------------------
 @app.post("/edit_post", response_class=HTMLResponse)
-async def edit_post(
+def edit_post(
     request: Request,
     post_id: int = Form(...),
     new_bio: str = Form(...),
@@ -395,24 +529,17 @@ async def edit_post(
     if not consultant_id:
         return RedirectResponse("/consultant-register")
 
-    post = db.query(ConsultantPost).get(post_id)
+    post = db.get(ConsultantPost, post_id)
     if not post or post.consultant_id != consultant_id:
         raise HTTPException(status_code=403, detail="Not authorized to edit")
 
-    # replace media if provided
+    # replace media if provided (the old file may be shared; gc_media.py sweeps it once unused)
     if new_media and new_media.filename:
-        if post.media_path:
-            old_path = os.path.join(UPLOADS_DIR, post.media_path)
-            if os.path.exists(old_path):
-                try:
-                    os.remove(old_path)
-                except Exception:
-                    pass
-        post.media_path = save_upload(new_media)
-        post.media_type = "video" if os.path.splitext(post.media_path)[1].lower() in [".mp4", ".mov", ".avi", ".webm"] else "image"
+        post.media_key = save_upload(new_media)
+        post.media_type = media_type_of(post.media_key)
 
     post.content = new_bio
-    post.timestamp = datetime.utcnow()
+    post.timestamp = utcnow()
     db.commit()
     return RedirectResponse("/consultant_post", status_code=303)
 
@@ -425,19 +552,10 @@ def delete_post(request: Request, post_id: int = Form(...), db: Session = Depend
     if not consultant_id:
         return RedirectResponse("/consultant-register")
 
-    post = db.query(ConsultantPost).get(post_id)
+    post = db.get(ConsultantPost, post_id)
     if not post or post.consultant_id != consultant_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete")
 
-    # delete file if exists
-    if post.media_path:
-        p = os.path.join(UPLOADS_DIR, post.media_path)
-        if os.path.exists(p):
-            try:
-                os.remove(p)
-            except Exception:
-                pass
-
     db.delete(post)
     db.commit()
     return RedirectResponse("/consultant_post", status_code=303)
@@ -446,78 +564,127 @@ def delete_post(request: Request, post_id: int = Form(...), db: Session = Depend
 # Public feed (filter by specialization / search)
 # -------------------------------
 @app.get("/consultants", response_class=HTMLResponse)
-def consultants_page(request: Request, q: str = None, specialization: str = None, db: Session = Depends(get_db)):
-    # Build base query joining consultant
-    query = db.query(ConsultantPost).join(Consultant)
+def consultants_page(request: Request, q: str = None, specialization: str = None, following: bool = False, db: Session = Depends(get_db), user: Optional[User] = Depends(current_user)):
+    etag = content_etag(db, request)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    # Read-only page: select just the columns the template shows as plain rows,
+    # skipping ORM instance construction and identity-map bookkeeping
+    stmt = select(
+        Bundle("post", ConsultantPost.id, ConsultantPost.title, ConsultantPost.content,
+               ConsultantPost.media_key, ConsultantPost.media_type, ConsultantPost.timestamp,
+               ConsultantPost.like_count, ConsultantPost.comment_count),
+        Bundle("consultant", Consultant.id, Consultant.name, Consultant.specialization,
+               Consultant.bio, Consultant.media_key, Consultant.follower_count),
+    ).join(ConsultantPost.consultant)
+    if following and user:
+        # posts from followed consultants: newest first straight off ix_timeline_user_ts, one page
+        stmt = (
+            stmt.join(TimelineEntry, TimelineEntry.post_id == ConsultantPost.id)
+            .where(TimelineEntry.user_id == user.id)
+            .order_by(TimelineEntry.timestamp.desc())
+            .limit(TIMELINE_BACKFILL)
+        )
+    else:
+        stmt = stmt.order_by(ConsultantPost.timestamp.desc())
     if specialization:
-        query = query.filter(Consultant.specialization.ilike(f"%{specialization}%"))
+        stmt = stmt.where(Consultant.specialization.ilike(f"%{specialization}%"))
     if q:
         q_like = f"%{q}%"
-        query = query.filter(
+        stmt = stmt.where(
             (Consultant.name.ilike(q_like)) |
             (Consultant.bio.ilike(q_like)) |
             (ConsultantPost.content.ilike(q_like)) |
             (Consultant.specialization.ilike(q_like))
         )
-    posts = query.order_by(ConsultantPost.timestamp.desc()).all()
+    rows = db.execute(stmt).all()
+    user_id = user.id if user else None
+    liked = liked_post_ids(db, user_id, [p.id for p, _ in rows])
+    followed = followed_consultant_ids(db, user_id, {c.id for _, c in rows})
 
-    # Construct result list for template
+    # Construct result list for template (counts are denormalized onto the rows)
     result = []
-    for p in posts:
-        c = db.query(Consultant).get(p.consultant_id)
-        likes_count = db.query(Like).filter(Like.post_id == p.id).count()
-        comments = db.query(Comment).filter(Comment.post_id == p.id).order_by(Comment.timestamp.asc()).all()
-        followers_count = db.query(Follower).filter(Follower.consultant_id == c.id).count()
+    for p, c in rows:
         result.append({
             "post": p,
             "consultant": c,
-            "likes_count": likes_count,
-            "comments": comments,
-            "followers_count": followers_count,
-            "profile_pic": media_url_for(c.media_path) if c.media_path else None,
-            "media_url": media_url_for(p.media_path) if p.media_path else None
+            "likes_count": p.like_count,
+            "comments_count": p.comment_count,
+            "followers_count": c.follower_count,
+            "liked": p.id in liked,
+            "followed": c.id in followed,
+            "profile_pic": media_url_for(c.media_key),
+            "media_url": media_url_for(p.media_key)
         })
 
-    # Also pass logged-in user if present (for UI)
-    user_email = request.session.get("user_email") or request.session.get("user")
-    user = None
-    if user_email:
-        user = get_current_user(db, user_email)
-    return templates.TemplateResponse("consultants.html", {"request": request, "posts": result, "q": q, "selected_specialization": specialization, "user": user})
+    return templates.TemplateResponse(
+        "consultants.html",
+        {"request": request, "posts": result, "q": q, "selected_specialization": specialization, "following": following, "user": user},
+        headers={"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL},
+    )
 
 # -------------------------------
 # Consultant profile page (shows consultant and their posts)
 # -------------------------------
+PROFILE_PAGE_SIZE = 20
+
 @app.get("/consultant/{consultant_id}", response_class=HTMLResponse)
-def consultant_profile(request: Request, consultant_id: int, db: Session = Depends(get_db)):
-    c = db.query(Consultant).get(consultant_id)
+def consultant_profile(request: Request, consultant_id: int, before: Optional[int] = None, db: Session = Depends(get_db), user: Optional[User] = Depends(current_user)):
+    c = get_consultant(db, consultant_id)
     if not c:
         raise HTTPException(status_code=404, detail="Consultant not found")
-    posts = db.query(ConsultantPost).filter_by(consultant_id=consultant_id).order_by(ConsultantPost.timestamp.desc()).all()
-    for p in posts:
-        p.likes_count = db.query(Like).filter(Like.post_id == p.id).count()
-        p.comments = db.query(Comment).filter(Comment.post_id == p.id).order_by(Comment.timestamp.asc()).all()
-    profile_pic = media_url_for(c.media_path) if c.media_path else None
-    # pass logged-in user as well
-    user_email = request.session.get("user_email") or request.session.get("user")
-    user = None
-    if user_email:
-        user = get_current_user(db, user_email)
-    return templates.TemplateResponse("consultant_profile.html", {"request": request, "consultant": c, "posts": posts, "profile_pic": profile_pic, "user": user})
+    etag = content_etag(db, request, consultant_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    # keyset pagination: `before` is the id of the last post on the previous page, and the next
+    # page continues after its (timestamp, id) straight off ix_post_consultant_ts (no OFFSET scan)
+    query = db.query(ConsultantPost).filter_by(consultant_id=consultant_id)
+    if before is not None:
+        cursor_ts = select(ConsultantPost.timestamp).where(ConsultantPost.id == before).scalar_subquery()
+        query = query.filter(or_(
+            ConsultantPost.timestamp < cursor_ts,
+            and_(ConsultantPost.timestamp == cursor_ts, ConsultantPost.id < before),
+        ))
+    posts = (
+        query.options(selectinload(ConsultantPost.comments))
+        .order_by(ConsultantPost.timestamp.desc(), ConsultantPost.id.desc())
+        .limit(PROFILE_PAGE_SIZE + 1)
+        .all()
+    )
+    next_before = posts[PROFILE_PAGE_SIZE - 1].id if len(posts) > PROFILE_PAGE_SIZE else None
+    posts = posts[:PROFILE_PAGE_SIZE]
+    profile_pic = media_url_for(c["media_key"])
+    user_id = user.id if user else None
+    return templates.TemplateResponse(
+        "consultant_profile.html",
+        {"request": request, "consultant": c, "followers_count": get_follower_count(db, consultant_id),
+         "followed": bool(followed_consultant_ids(db, user_id, [consultant_id])),
+         "liked_ids": liked_post_ids(db, user_id, [p.id for p in posts]),
+         "posts": posts, "next_before": next_before, "profile_pic": profile_pic, "user": user},
+        headers={"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL},
+    )
 
 # -------------------------------
 # Like / Unlike a post
 # -------------------------------
 @app.post("/post/{post_id}/like")
 def like_post(request: Request, post_id: int, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")  # may be None (anonymous)
-    existing = db.query(Like).filter(Like.post_id == post_id, Like.user_id == user_id).first()
-    if existing:
-        db.delete(existing)
-        db.commit()
-        return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
-    like = Like(user_id=user_id, post_id=post_id, consultant_id=db.query(ConsultantPost).get(post_id).consultant_id if db.query(ConsultantPost).get(post_id) else None)
-    db.add(like)
+    user_id = request.session.get("user_id")
+    if not user_id:  # a like is keyed by (user, post), so anonymous visitors log in first
+        return RedirectResponse("/login", status_code=303)
+    # toggle: try the unlike first; only insert when there was nothing to delete
+    # (Core statements skip the ORM counter events, so like_count is bumped here)
+    removed = db.execute(delete(Like).where(Like.post_id == post_id, Like.user_id == user_id)).rowcount
+    if removed:
+        bump_counter(db.connection(), Like, post_id, -removed)
+    else:
+        # INSERT ... SELECT: a missing post inserts nothing instead of violating the foreign key
+        post = select(literal(user_id), ConsultantPost.id).where(ConsultantPost.id == post_id)
+        added = db.execute(insert_ignore(db, Like).from_select(["user_id", "post_id"], post)).rowcount
+        bump_counter(db.connection(), Like, post_id, added)
     db.commit()
     return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
 
@@ -529,10 +696,10 @@ def comment_post(request: Request, post_id: int, comment_text: str = Form(...),
     user_id = request.session.get("user_id")  # may be None
     if not comment_text or not comment_text.strip():
         return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
-    post = db.query(ConsultantPost).get(post_id)
+    post = db.get(ConsultantPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    c = Comment(user_id=user_id, post_id=post_id, consultant_id=post.consultant_id, comment_text=comment_text)
+    c = Comment(user_id=user_id, post_id=post_id, comment_text=comment_text)
     db.add(c)
     db.commit()
     return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
@@ -542,35 +709,32 @@ def comment_post(request: Request, post_id: int, comment_text: str = Form(...),
 # -------------------------------
 @app.post("/consultant/{consultant_id}/follow")
 def follow_consultant(request: Request, consultant_id: int, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")  # may be None
-    existing = db.query(Follower).filter(Follower.consultant_id == consultant_id, Follower.user_id == user_id).first()
-    if existing:
-        db.delete(existing)
-        db.commit()
-        return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
-    f = Follower(user_id=user_id, consultant_id=consultant_id)
-    db.add(f)
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return RedirectResponse("/login", status_code=303)
+    removed = db.execute(delete(Follower).where(Follower.consultant_id == consultant_id, Follower.user_id == user_id)).rowcount
+    if removed:
+        bump_counter(db.connection(), Follower, consultant_id, -removed)
+        drop_timeline(db.connection(), user_id, consultant_id)
+    else:
+        consultant = select(literal(user_id), Consultant.id).where(Consultant.id == consultant_id)
+        added = db.execute(insert_ignore(db, Follower).from_select(["user_id", "consultant_id"], consultant)).rowcount
+        bump_counter(db.connection(), Follower, consultant_id, added)
+        if added:
+            backfill_timeline(db.connection(), user_id, consultant_id)
+    invalidate_consultant(db, consultant_id, followers_only=True)
     db.commit()
     return RedirectResponse(request.headers.get("Referer", "/consultants"), status_code=303)
 
 # -------------------------------
-# AI: upload_and_query (keeps your original behavior but uses UPLOADS_DIR)
+# AI: upload_and_query (image is sent straight to Gemini, not stored)
 # -------------------------------
 @app.post("/upload_and_query")
-async def upload_and_query(request: Request, image: UploadFile = File(...), query: str = Form(...)):
+def upload_and_query(request: Request, image: UploadFile = File(...), query: str = Form(...)):
     try:
-        # save temporary file into uploads
-        tmp_filename = save_upload(image)
-        file_path = os.path.join(UPLOADS_DIR, tmp_filename)
-        model = genai.GenerativeModel(MODEL_NAME)
-        with open(file_path, "rb") as img_file:
-            result = model.generate_content([query, {"mime_type": image.content_type, "data": img_file.read()}])
-        # remove temp
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
-        return JSONResponse({"response": getattr(result, "text", "No response received."), "model": MODEL_NAME})
+        # the image is only forwarded to Gemini, so it never needs to touch the disk
+        text = generate_text([query, {"mime_type": image.content_type, "data": image.file.read()}])
+        return JSONResponse({"response": text or "No response received.", "model": MODEL_NAME})
     except Exception as e:
         return JSONResponse({"detail": f"Error: {str(e)}"}, status_code=500)
 
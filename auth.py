@@ -1,4 +1,10 @@
 import hashlib
+import hmac
+import re
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from models import User
 
@@ -6,18 +12,49 @@ from models import User
 # -------------------------------
 # Password Utility Functions
 # -------------------------------
+_hasher = PasswordHasher()
+
+# hashes written before the switch to argon2 are bare SHA256 hex digests
+_LEGACY_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def _is_legacy_hash(hashed_password: str) -> bool:
+    return bool(hashed_password) and _LEGACY_SHA256_RE.fullmatch(hashed_password) is not None
+
+
 def hash_password(password: str) -> str:
-    """Hash password using SHA256 (no length restrictions)."""
+    """Hash password using argon2id (salted, no length restrictions)."""
     if not isinstance(password, str):
         password = str(password)
     password = password.strip()
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    return _hasher.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify SHA256 password."""
+    """Verify a password against an argon2 or legacy SHA256 hash."""
     plain_password = plain_password.strip()
-    return hash_password(plain_password) == hashed_password
+    if _is_legacy_hash(hashed_password):
+        legacy = hashlib.sha256(plain_password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, hashed_password)
+    try:
+        return _hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True if the stored hash is legacy SHA256 or uses outdated argon2 parameters."""
+    if _is_legacy_hash(hashed_password):
+        return True
+    try:
+        return _hasher.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return True
+
+
+def _email_matches(email: str):
+    # lower(email) = ? is answered by the uq_users_email_ci functional index
+    return func.lower(User.email) == email.strip().lower()
 
 
 # -------------------------------
@@ -28,7 +65,7 @@ def register_user(db: Session, email: str, password: str):
     email = email.strip().lower()
     password = password.strip()
 
-    existing_user = db.query(User).filter(User.email == email).first()
+    existing_user = db.query(User).filter(_email_matches(email)).first()
     if existing_user:
         raise ValueError("Email already registered. Please log in.")
 
@@ -45,9 +82,13 @@ def register_user(db: Session, email: str, password: str):
 # -------------------------------
 def login_user(db: Session, email: str, password: str):
     """Validate user login credentials."""
-    user = db.query(User).filter(User.email == email.strip().lower()).first()
+    user = db.query(User).filter(_email_matches(email)).first()
     if not user or not verify_password(password, user.hashed_password):
         return None
+    # upgrade legacy / outdated hashes now that we have the plaintext
+    if needs_rehash(user.hashed_password):
+        user.hashed_password = hash_password(password)
+        db.commit()
     return user
 
 
@@ -55,8 +96,8 @@ def login_user(db: Session, email: str, password: str):
 # Get Current User
 # -------------------------------
 def get_current_user(db: Session, email: str):
-    """Fetch a user by email."""
-    return db.query(User).filter(User.email == email.strip().lower()).first()
+    """Fetch a user by email (case-insensitive)."""
+    return db.query(User).filter(_email_matches(email)).first()
 
 
 # -------------------------------
@@ -0,0 +1,155 @@
+"""Cache for consultant profiles and follower counts, which are read on every page but rarely change.
+
+Keys:
+    consultant:{id}            profile columns (name, specialization, bio, media)
+    consultant:{id}:followers  follower_count
+
+Entries expire after CACHE_TTL seconds and are dropped as soon as the transaction that
+changed them commits. With REDIS_URL set the cache is shared by all workers; otherwise
+each process keeps its own. The cache is never required: if Redis is unreachable, reads
+fall back to the database and failed invalidations are logged (entries then expire by TTL).
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+import orjson
+from cachetools import TTLCache
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from models import Consultant, Follower
+
+CACHE_TTL = 300
+REDIS_URL = os.getenv("REDIS_URL")
+
+log = logging.getLogger(__name__)
+
+
+class _LocalBackend:
+    """In-process stand-in for the subset of the Redis client used here."""
+
+    def __init__(self, maxsize: int = 4096):
+        self._data = TTLCache(maxsize=maxsize, ttl=CACHE_TTL)
+        self._lock = threading.Lock()  # TTLCache is not thread-safe
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def setex(self, key, ttl, value):
+        with self._lock:
+            self._data[key] = value
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+if REDIS_URL:
+    import redis
+
+    # short timeouts: with Redis down, a page should fall back to the database, not hang on it
+    backend = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+    BACKEND_ERRORS = (redis.RedisError,)
+else:
+    backend = _LocalBackend()
+    BACKEND_ERRORS = ()
+
+PROFILE_COLUMNS = (
+    Consultant.id, Consultant.name, Consultant.specialization,
+    Consultant.bio, Consultant.media_key, Consultant.media_type,
+)
+
+
+def _profile_key(consultant_id: int) -> str:
+    return f"consultant:{consultant_id}"
+
+
+def _followers_key(consultant_id: int) -> str:
+    return f"consultant:{consultant_id}:followers"
+
+
+def _cached(key: str, load):
+    try:
+        raw = backend.get(key)
+    except BACKEND_ERRORS:
+        log.warning("cache read of %s failed; reading the database", key, exc_info=True)
+        return load()
+    if raw is not None:
+        return orjson.loads(raw)
+    value = load()
+    if value is not None:
+        try:
+            backend.setex(key, CACHE_TTL, orjson.dumps(value))
+        except BACKEND_ERRORS:
+            log.warning("cache write of %s failed", key, exc_info=True)
+    return value
+
+
+def get_consultant(db: Session, consultant_id: int) -> Optional[dict]:
+    """Profile columns of one consultant as a dict, or None if there is no such consultant."""
+    def load():
+        row = db.execute(select(*PROFILE_COLUMNS).where(Consultant.id == consultant_id)).mappings().first()
+        return dict(row) if row else None
+    return _cached(_profile_key(consultant_id), load)
+
+
+def get_follower_count(db: Session, consultant_id: int) -> int:
+    def load():
+        return db.scalar(select(Consultant.follower_count).where(Consultant.id == consultant_id))
+    return _cached(_followers_key(consultant_id), load) or 0
+
+
+def invalidate_consultant(db: Session, consultant_id: int, followers_only: bool = False):
+    """Drop the cached entries for `consultant_id` once `db` commits.
+
+    ORM writes to Consultant / Follower and Follower rows inserted through session.execute()
+    call this automatically; other Core statements must call it themselves.
+    """
+    keys = db.info.setdefault("cache_invalidate", set())
+    keys.add(_followers_key(consultant_id))
+    if not followers_only:
+        keys.add(_profile_key(consultant_id))
+
+
+# invalidating only after the commit keeps other requests from re-caching the old row
+# while this transaction is still open
+@event.listens_for(Session, "after_commit")
+def _drop_invalidated(session):
+    keys = session.info.pop("cache_invalidate", None)
+    if keys:
+        # the write has already committed; a failure here must not turn it into an error page
+        try:
+            backend.delete(*keys)
+        except BACKEND_ERRORS:
+            log.warning("cache invalidation of %s failed; stale for up to %ss", sorted(keys), CACHE_TTL, exc_info=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidated(session):
+    session.info.pop("cache_invalidate", None)
+
+
+@event.listens_for(Consultant, "after_update")
+@event.listens_for(Consultant, "after_delete")
+def _consultant_changed(mapper, connection, target):
+    invalidate_consultant(object_session(target), target.id)
+
+
+@event.listens_for(Follower, "after_insert")
+@event.listens_for(Follower, "after_delete")
+def _followers_changed(mapper, connection, target):
+    invalidate_consultant(object_session(target), target.consultant_id, followers_only=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _followers_bulk_inserted(state):
+    # Core INSERTs of explicit rows (models.bulk_insert) skip the mapper events above
+    if not state.is_insert or state.statement.table.name != Follower.__tablename__:
+        return
+    rows = state.parameters if isinstance(state.parameters, list) else [state.parameters or {}]
+    for consultant_id in {row.get("consultant_id") for row in rows} - {None}:
+        invalidate_consultant(state.session, consultant_id, followers_only=True)
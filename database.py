@@ -1,10 +1,57 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./medi_ai.db")
+
+# driver-specific options
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+_engine_options = {}
+if _url.get_backend_name() == "sqlite":
+    # cached_statements: prepared statements kept per connection (sqlite3 default 128)
+    _engine_options["connect_args"] = {"check_same_thread": False, "cached_statements": 256}
+if _url.get_driver_name() == "psycopg":
+    # psycopg 3 prepares a statement on the server after it has run 5 times on a connection
+    _engine_options["connect_args"] = {"prepare_threshold": 5}
+if _url.get_driver_name() == "psycopg2":
+    # executemany() as batched INSERT ... VALUES pages instead of one statement per row
+    _engine_options["executemany_mode"] = "values_plus_batch"
+
+# One engine (and so one pool) per process, created at import and shared by every request:
+# pooled connections keep their driver-side prepared statements between requests, and
+# pre_ping replaces connections that went stale while idle instead of failing the request.
+# query_cache_size bounds SQLAlchemy's compiled-SQL LRU cache, which is engine-wide, so
+# statements are compiled once per process, not per session.
+# insertmanyvalues sends multi-row INSERTs (with RETURNING where needed) in pages of
+# 1000 rows, kept under the driver's bound-parameter limit by SQLAlchemy.
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200,
+    use_insertmanyvalues=True,
+    insertmanyvalues_page_size=1000,
+    **_engine_options,
+)
+
+@event.listens_for(engine, "connect")
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores FOREIGN KEY constraints (and so ON DELETE CASCADE) unless each
+    # connection opts in
+    if engine.dialect.name == "sqlite":
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./medi_ai.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    """Declarative base for the models (typed `Mapped[...]` / `mapped_column` style)."""
 
 def init_db():
     try:
@@ -0,0 +1,61 @@
+"""Delete uploaded files that no consultant, post or quiz refers to any more.
+
+Uploads are stored once per content (see models.media_file), so the app never deletes
+a file itself: another request may be committing a row that points at the same bytes.
+Run `python gc_media.py` now and then (e.g. daily from cron); `--dry-run` only lists
+what would go. Files written in the last MIN_AGE seconds are always kept, which covers
+uploads whose row is not committed yet.
+"""
+import os
+import sys
+import time
+
+from sqlalchemy import select, union
+
+from database import SessionLocal
+from models import Consultant, ConsultantPost, HealthQuiz, UPLOADS_DIR
+
+MIN_AGE = 24 * 60 * 60
+
+
+def referenced_keys(db) -> set:
+    return set(db.scalars(union(
+        select(Consultant.media_key),
+        select(ConsultantPost.media_key),
+        select(HealthQuiz.image_key),
+    )))
+
+
+def collect(dry_run: bool = False) -> list:
+    """Remove unreferenced files older than MIN_AGE and return their paths."""
+    cutoff = time.time() - MIN_AGE
+    with SessionLocal() as db:
+        keep = referenced_keys(db)
+    removed = []
+    for prefix in sorted(os.listdir(UPLOADS_DIR)):
+        folder = os.path.join(UPLOADS_DIR, prefix)
+        if len(prefix) != 2 or not os.path.isdir(folder):
+            continue  # filenames from before media keys, and upload temp files
+        for key in sorted(os.listdir(folder)):
+            path = os.path.join(folder, key)
+            if key in keep or os.path.getmtime(path) >= cutoff:
+                continue
+            if dry_run:
+                removed.append(path)
+                continue
+            # move the file aside before the final age check: save_upload() replaces the path
+            # with a freshly written copy, so a recent mtime here means it was just re-uploaded
+            aside = path + ".gc"
+            os.replace(path, aside)
+            if os.path.getmtime(aside) >= cutoff:
+                os.replace(aside, path)  # same key, same bytes as any copy written meanwhile
+            else:
+                os.remove(aside)
+                removed.append(path)
+    return removed
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv[1:]
+    for path in collect(dry_run):
+        print(("would remove " if dry_run else "removed ") + path)
@@ -0,0 +1,303 @@
+"""Bring an existing medi_ai.db up to date with models.py.
+
+Base.metadata.create_all() only creates missing tables; it never alters tables that
+already exist. app.py runs migrate() on startup, and `python migrate_db.py` does the
+same by hand. Every step checks the current schema first, so re-running is harmless,
+and all steps run in one exclusive transaction: concurrent workers upgrade only once,
+and a failed upgrade leaves the database as it was.
+
+The steps are SQLite-only (they read sqlite_master and rely on SQLite PRAGMAs). Other
+databases (DATABASE_URL) only get create_all(), so they must start out empty: their
+tables are then created from the current models and need no upgrade.
+"""
+import hashlib
+import os
+import re
+import shutil
+
+from sqlalchemy import SmallInteger, inspect, text
+
+from database import engine
+from models import Base, MEDIA_KEY_HEX, TIMELINE_BACKFILL, UPLOADS_DIR, media_file
+
+
+def _columns(conn, table: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+# how a rebuilt table fills a column shared with the old table, when not the old value as-is
+COPY_EXPRS = {
+    "timestamp": "COALESCE(timestamp, CURRENT_TIMESTAMP)",  # NOT NULL since the server default
+    # media_type names -> MediaType numbers (numbers pass through unchanged)
+    "media_type": ("CASE media_type WHEN 'image' THEN 1 WHEN 'video' THEN 2 "
+                   "WHEN 'audio' THEN 3 WHEN 'pdf' THEN 4 ELSE media_type END"),
+}
+
+# new name -> old name, for columns a rebuilt table fills from a renamed column
+RENAMED_COLUMNS = {"media_key": "media_path", "image_key": "image_path"}
+
+
+def _rebuild(conn, table_name: str, exprs: dict = None, tail: str = ""):
+    """Recreate `table_name` from its current model definition and copy the rows across.
+
+    SQLite cannot change column defaults, constraints or keys in place. `exprs` maps a
+    column name to the SQL expression that fills it (falling back to COPY_EXPRS, then the
+    old column as-is); `tail` is appended to the copying SELECT (WHERE / GROUP BY).
+    """
+    table = Base.metadata.tables[table_name]
+    old = f"_old_{table_name}"
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {old}"))
+    # named indexes move with the renamed table; drop them so the rebuilt table can reuse the names
+    # (sql IS NULL marks SQLite's own constraint indexes, which go with the old table)
+    indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t AND sql IS NOT NULL"), {"t": old})
+    for name in indexes.scalars().all():
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    table.create(conn)
+    old_columns = _columns(conn, old)
+    exprs = {
+        **{name: e for name, e in COPY_EXPRS.items() if name in old_columns},
+        **{new: old_name for new, old_name in RENAMED_COLUMNS.items() if old_name in old_columns},
+        **(exprs or {}),
+    }
+    targets = [c.name for c in table.columns if c.name in exprs or c.name in old_columns]
+    sources = [exprs.get(name, name) for name in targets]
+    conn.execute(text(f"INSERT INTO {table_name} ({', '.join(targets)}) SELECT {', '.join(sources)} FROM {old} {tail}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+
+# -------------------------------
+# Migration steps (oldest first)
+# -------------------------------
+def create_missing_indexes(conn):
+    """Indexes declared on models after their table was first created."""
+    # read sqlite_master directly: the inspector does not report expression indexes
+    existing = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+
+def add_quiz_recommendations(conn):
+    if "recommendations" not in _columns(conn, "health_quizzes"):
+        conn.execute(text("ALTER TABLE health_quizzes ADD COLUMN recommendations TEXT"))
+
+
+def add_denormalized_counts(conn):
+    """like/comment/follower counters, backfilled from the existing rows."""
+    counters = [
+        ("consultant_posts", "like_count", "SELECT count(*) FROM likes WHERE likes.post_id = consultant_posts.id"),
+        ("consultant_posts", "comment_count", "SELECT count(*) FROM comments WHERE comments.post_id = consultant_posts.id"),
+        ("consultants", "follower_count", "SELECT count(*) FROM followers WHERE followers.consultant_id = consultants.id"),
+    ]
+    for table, column, count_sql in counters:
+        if column not in _columns(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text(f"UPDATE {table} SET {column} = ({count_sql})"))
+
+
+def backfill_timelines(conn):
+    """Fill timeline_entries from the existing follows (only while the table is still empty).
+
+    Each follow gets its consultant's TIMELINE_BACKFILL most recent posts, as a new follow does.
+    """
+    if conn.execute(text("SELECT 1 FROM timeline_entries LIMIT 1")).first():
+        return
+    conn.execute(text(
+        "INSERT INTO timeline_entries (user_id, post_id, timestamp) "
+        "SELECT user_id, post_id, timestamp FROM ("
+        " SELECT f.user_id, p.id AS post_id, p.timestamp, ROW_NUMBER() OVER ("
+        "  PARTITION BY f.user_id, f.consultant_id ORDER BY p.timestamp DESC) AS n"
+        " FROM (SELECT DISTINCT user_id, consultant_id FROM followers WHERE user_id IS NOT NULL) f"
+        " JOIN consultant_posts p ON p.consultant_id = f.consultant_id"
+        " WHERE p.timestamp IS NOT NULL"
+        ") WHERE n <= :limit"
+    ), {"limit": TIMELINE_BACKFILL})
+
+
+def composite_like_follower_keys(conn):
+    """likes / followers keyed by (user_id, post_id) / (user_id, consultant_id), no surrogate id.
+
+    Duplicate pairs collapse into their earliest row and anonymous (NULL user) rows are
+    dropped, so the counters are recounted.
+    """
+    keyed = [
+        ("likes", "post_id", "consultant_posts", "like_count"),
+        ("followers", "consultant_id", "consultants", "follower_count"),
+    ]
+    for table, key, parent, counter in keyed:
+        if "id" not in _columns(conn, table):
+            continue
+        _rebuild(conn, table, {"timestamp": f"MIN({COPY_EXPRS['timestamp']})"},
+                 f"WHERE user_id IS NOT NULL AND {key} IS NOT NULL GROUP BY user_id, {key}")
+        conn.execute(text(f"UPDATE {parent} SET {counter} = (SELECT count(*) FROM {table} WHERE {table}.{key} = {parent}.id)"))
+
+
+TIMESTAMPED = ("consultant_posts", "likes", "comments", "followers", "health_quizzes")
+
+
+def add_timestamp_server_defaults(conn):
+    """timestamp columns moved from a Python-side default to the database clock."""
+    for table in TIMESTAMPED:
+        timestamp = next(c for c in inspect(conn).get_columns(table) if c["name"] == "timestamp")
+        if timestamp["default"] is None:
+            _rebuild(conn, table)
+
+
+def media_type_smallint(conn):
+    """media_type moved from free text to a MediaType SMALLINT (converted by COPY_EXPRS)."""
+    for table in ("consultants", "consultant_posts"):
+        media_type = next(c for c in inspect(conn).get_columns(table) if c["name"] == "media_type")
+        if not isinstance(media_type["type"], SmallInteger):
+            _rebuild(conn, table)
+
+
+def quiz_answers_json(conn):
+    """question_1/2/3 folded into the single `answers` JSON column."""
+    if "question_1" in _columns(conn, "health_quizzes"):
+        _rebuild(conn, "health_quizzes", {
+            "answers": "json_object('q1', question_1, 'q2', question_2, 'q3', question_3)",
+        })
+
+
+def case_insensitive_email(conn):
+    """The plain unique index on users.email gave way to uq_users_email_ci on lower(email)."""
+    if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_users_email'")).first():
+        conn.execute(text("DROP INDEX ix_users_email"))
+
+
+def post_index_desc(conn):
+    """ix_post_consultant_ts became (consultant_id, timestamp DESC, id DESC) for keyset paging."""
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'ix_post_consultant_ts'")).scalar()
+    if sql and "DESC" not in sql:
+        conn.execute(text("DROP INDEX ix_post_consultant_ts"))
+        next(i for i in Base.metadata.tables["consultant_posts"].indexes if i.name == "ix_post_consultant_ts").create(conn)
+
+
+def drop_comment_consultant(conn):
+    """comments.consultant_id duplicated the post's consultant; it is derived through the post now."""
+    if "consultant_id" in _columns(conn, "comments"):
+        _rebuild(conn, "comments")
+
+
+def fk_on_delete(conn):
+    """Foreign keys gained ON DELETE actions (the ORM no longer sweeps child rows itself)."""
+    for table in Base.metadata.sorted_tables:
+        declared = {tuple(fk.parent.name for fk in c.elements): c.ondelete for c in table.foreign_key_constraints}
+        reflected = {tuple(fk["constrained_columns"]): fk["options"].get("ondelete")
+                     for fk in inspect(conn).get_foreign_keys(table.name)}
+        if any(reflected.get(cols) != ondelete for cols, ondelete in declared.items()):
+            _rebuild(conn, table.name)
+
+
+def content_addressed_media(conn):
+    """Uploads are stored under a content-hash media key instead of their upload-time filename.
+
+    Existing files are hard-linked (or copied) to their key's path; the originals stay
+    in place, so older code keeps working until they are cleaned up by hand.
+    """
+    keyed = r"^[0-9a-f]{%d}(\.\w+)?$" % MEDIA_KEY_HEX
+    keys = {}
+    for table, column in (("consultants", "media_key"), ("consultant_posts", "media_key"), ("health_quizzes", "image_key")):
+        if column not in _columns(conn, table):
+            _rebuild(conn, table)  # fills the key column from the old filename (RENAMED_COLUMNS)
+        rows = conn.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")).all()
+        for row_id, name in rows:
+            if re.match(keyed, name):
+                continue
+            if name not in keys:
+                keys[name] = _store_legacy_upload(name)
+            conn.execute(text(f"UPDATE {table} SET {column} = :key WHERE id = :id"), {"key": keys[name], "id": row_id})
+
+
+def _store_legacy_upload(name: str):
+    """Link static/uploads/<name> under its media key; None when the file is gone."""
+    path = os.path.join(UPLOADS_DIR, name)
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    key = digest.hexdigest()[:MEDIA_KEY_HEX] + os.path.splitext(name)[1].lower()
+    dest = media_file(key)
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copy2(path, dest)
+    return key
+
+
+def subsecond_timestamps(conn):
+    """timestamp defaults keep milliseconds on SQLite (CURRENT_TIMESTAMP gave whole seconds)."""
+    for table in TIMESTAMPED:
+        timestamp = next(c for c in inspect(conn).get_columns(table) if c["name"] == "timestamp")
+        if "%f" not in (timestamp["default"] or ""):
+            _rebuild(conn, table)
+
+
+# _rebuild() always recreates a table from the *current* model, so steps that rebuild with
+# their own row transform run before the plain rebuilds, which would otherwise trip over them
+MIGRATIONS = [
+    create_missing_indexes,
+    add_quiz_recommendations,
+    add_denormalized_counts,
+    backfill_timelines,
+    composite_like_follower_keys,
+    quiz_answers_json,
+    add_timestamp_server_defaults,
+    media_type_smallint,
+    fk_on_delete,
+    case_insensitive_email,
+    post_index_desc,
+    drop_comment_consultant,
+    content_addressed_media,
+    subsecond_timestamps,
+]
+
+
+def migrate():
+    """Create missing tables and run every upgrade step, as one exclusive transaction on SQLite.
+
+    Safe to call from several processes at once: the first takes the lock and upgrades,
+    the rest wait for it and then find nothing left to do.
+    """
+    if engine.dialect.name != "sqlite":
+        Base.metadata.create_all(bind=engine)
+        return
+    with engine.connect() as conn:
+        dbapi_conn = conn.connection.driver_connection
+        # pysqlite commits implicitly around DDL; take over BEGIN/COMMIT so that schema
+        # changes and their backfills commit (or roll back) together
+        isolation_level = dbapi_conn.isolation_level
+        dbapi_conn.isolation_level = None
+        busy_timeout = conn.exec_driver_sql("PRAGMA busy_timeout").scalar()
+        try:
+            # table rebuilds rename tables: keep SQLite from enforcing or rewriting FK references meanwhile
+            # (neither PRAGMA can change inside a transaction)
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+            conn.exec_driver_sql("PRAGMA busy_timeout=60000")  # other workers wait out the upgrade
+            conn.exec_driver_sql("BEGIN EXCLUSIVE")
+            try:
+                Base.metadata.create_all(bind=conn)
+                for step in MIGRATIONS:
+                    step(conn)
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+            conn.exec_driver_sql("COMMIT")
+        finally:
+            conn.exec_driver_sql(f"PRAGMA busy_timeout={busy_timeout}")
+            conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+            dbapi_conn.isolation_level = isolation_level
+
+if __name__ == "__main__":
+    migrate()
+    if engine.dialect.name == "sqlite":
+        print("Database schema is up to date.")
+    else:
+        print(f"Created missing tables; upgrade steps only run on SQLite, not {engine.dialect.name}.")
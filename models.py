@@ -1,22 +1,96 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    SmallInteger, String, Text, ForeignKey, DateTime, Index, JSON,
+    delete, event, func, insert, select, text, update,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
+from sqlalchemy.sql.expression import FunctionElement
+from collections import Counter
 from datetime import datetime
+import os
+from enum import IntEnum
+from typing import List, Optional
 from database import Base
 
 
+# ------------------------------
+# Timestamps
+# ------------------------------
+class utcnow(FunctionElement):
+    """The database's current time, as a server default or an UPDATE value."""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return compiler.process(func.now(), **kw)
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP stops at whole seconds, so two edits in the same second would
+    # share a timestamp (and a page ETag); keep milliseconds
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+# ------------------------------
+# Media types (stored as SMALLINT)
+# ------------------------------
+class MediaType(IntEnum):
+    IMAGE = 1
+    VIDEO = 2
+    AUDIO = 3
+    PDF = 4
+
+
+def _media_type_value(value):
+    # rejects anything outside MediaType before it reaches the column
+    return MediaType(value).value if value is not None else None
+
+
+# ------------------------------
+# Media storage (content-addressed)
+# ------------------------------
+# An upload is stored once under its key: the first 32 hex chars of its SHA-256 plus its
+# extension (kept so static servers send the right Content-Type), at <UPLOADS_DIR>/<key[:2]>/<key>.
+# The bytes never change for a key, so MEDIA_BASE_URL can point at a CDN that mirrors UPLOADS_DIR.
+UPLOADS_DIR = os.path.join("static", "uploads")
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "/static/uploads").rstrip("/")
+MEDIA_KEY_HEX = 32
+
+
+def media_file(key: str) -> str:
+    """Path on disk of the upload stored under `key`."""
+    return os.path.join(UPLOADS_DIR, key[:2], key)
+
+
+def media_url_for(key: Optional[str]) -> Optional[str]:
+    return f"{MEDIA_BASE_URL}/{key[:2]}/{key}" if key else None
+
+
 # ------------------------------
 # User Table
 # ------------------------------
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True, nullable=False)
-    hashed_password = Column(String, nullable=False)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    email: Mapped[str] = mapped_column(String(320))  # 320: RFC 5321 maximum address length
 
-    likes = relationship("Like", back_populates="user", cascade="all, delete")
-    comments = relationship("Comment", back_populates="user", cascade="all, delete")
-    following = relationship("Follower", back_populates="user", cascade="all, delete")
+    __table_args__ = (
+        # one account per address regardless of case; also the login lookup index
+        Index("uq_users_email_ci", func.lower(email.column), unique=True),
+    )
+    hashed_password: Mapped[str] = mapped_column(String)
+
+    # not passive: these rows feed counters on *other* parents (posts, consultants), which
+    # are kept in step by the mapper events, so deleting a user goes through the ORM
+    likes: Mapped[List["Like"]] = relationship(back_populates="user", cascade="all, delete")
+    comments: Mapped[List["Comment"]] = relationship(back_populates="user", cascade="all, delete")
+    following: Mapped[List["Follower"]] = relationship(back_populates="user", cascade="all, delete")
+    health_quizzes: Mapped[List["HealthQuiz"]] = relationship(back_populates="user", passive_deletes=True)
 
 
 # ------------------------------
@@ -25,19 +99,32 @@ class User(Base):
 class Consultant(Base):
     __tablename__ = "consultants"
 
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    email = Column(String, nullable=False)
-    specialization = Column(String, nullable=False)
-    bio = Column(Text, nullable=True)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String)
+    email: Mapped[str] = mapped_column(String)
+    specialization: Mapped[str] = mapped_column(String)
+    bio: Mapped[Optional[str]] = mapped_column(Text)
+
+    media_key: Mapped[Optional[str]] = mapped_column(String(40))  # profile picture, see media_file()
+    media_type: Mapped[Optional[int]] = mapped_column(SmallInteger)  # MediaType
+    follower_count: Mapped[int] = mapped_column(server_default="0")
 
-    media_path = Column(String, nullable=True)
-    media_type = Column(String, nullable=True)
+    # collections never lazy-load: query sites must selectinload() what they render.
+    # passive_deletes: ON DELETE CASCADE removes the children in the database, without the
+    # ORM loading and deleting them one by one
+    posts: Mapped[List["ConsultantPost"]] = relationship(
+        back_populates="consultant", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
+    followers: Mapped[List["Follower"]] = relationship(
+        back_populates="consultant", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
+    health_quizzes: Mapped[List["HealthQuiz"]] = relationship(back_populates="consultant", passive_deletes=True)
 
-    posts = relationship("ConsultantPost", back_populates="consultant", cascade="all, delete")
-    likes = relationship("Like", back_populates="consultant", cascade="all, delete")
-    comments = relationship("Comment", back_populates="consultant", cascade="all, delete")
-    followers = relationship("Follower", back_populates="consultant", cascade="all, delete")
+    @property
+    def media_url(self) -> Optional[str]:
+        return media_url_for(self.media_key)
+
+    @validates("media_type")
+    def _check_media_type(self, key, value):
+        return _media_type_value(value)
 
 
 # ------------------------------
@@ -45,87 +132,247 @@ class Consultant(Base):
 # ------------------------------
 class ConsultantPost(Base):
     __tablename__ = "consultant_posts"
+    __table_args__ = (
+        # dashboard / profile pages list a consultant's posts newest first, paged by (timestamp, id)
+        Index("ix_post_consultant_ts", "consultant_id", text("timestamp DESC"), text("id DESC")),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    consultant_id = Column(Integer, ForeignKey("consultants.id"))
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    consultant_id: Mapped[int] = mapped_column(ForeignKey("consultants.id", ondelete="CASCADE"))
     
     # Title made optional for smoother usage
-    title = Column(String, nullable=True)
+    title: Mapped[Optional[str]] = mapped_column(String)
+
+    content: Mapped[Optional[str]] = mapped_column(Text)
+    media_key: Mapped[Optional[str]] = mapped_column(String(40))  # see media_file()
+    media_type: Mapped[Optional[int]] = mapped_column(SmallInteger)  # MediaType
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=utcnow())
+    like_count: Mapped[int] = mapped_column(server_default="0")
+    comment_count: Mapped[int] = mapped_column(server_default="0")
 
-    content = Column(Text, nullable=True)
-    media_path = Column(String, nullable=True)
-    media_type = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    consultant: Mapped["Consultant"] = relationship(back_populates="posts", lazy="raise_on_sql")
+    likes: Mapped[List["Like"]] = relationship(
+        back_populates="post", cascade="all, delete-orphan", passive_deletes=True, lazy="raise")
+    comments: Mapped[List["Comment"]] = relationship(
+        back_populates="post", cascade="all, delete-orphan", passive_deletes=True,
+        order_by="Comment.timestamp.asc()", lazy="raise")
 
-    consultant = relationship("Consultant", back_populates="posts")
-    likes = relationship("Like", back_populates="post", cascade="all, delete")
-    comments = relationship("Comment", back_populates="post", cascade="all, delete")
+    @property
+    def media_url(self) -> Optional[str]:
+        return media_url_for(self.media_key)
+
+    @validates("media_type")
+    def _check_media_type(self, key, value):
+        return _media_type_value(value)
 
 
 # ------------------------------
 # Likes Table
 # ------------------------------
 class Like(Base):
+    """A (user, post) pair: the primary key is the one-like-per-user rule and the like/unlike lookup.
+
+    The post's consultant is reached through `like.post.consultant`.
+    """
     __tablename__ = "likes"
+    __table_args__ = (
+        Index("ix_like_post_id", "post_id"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    consultant_id = Column(Integer, ForeignKey("consultants.id"))
-    post_id = Column(Integer, ForeignKey("consultant_posts.id"))
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey("consultant_posts.id", ondelete="CASCADE"), primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=utcnow())
 
-    user = relationship("User", back_populates="likes")
-    consultant = relationship("Consultant", back_populates="likes")
-    post = relationship("ConsultantPost", back_populates="likes")
+    user: Mapped["User"] = relationship(back_populates="likes")
+    post: Mapped["ConsultantPost"] = relationship(back_populates="likes")
 
 
 # ------------------------------
 # Comments Table
 # ------------------------------
 class Comment(Base):
+    """A comment on a post; the post's consultant is reached through `comment.post.consultant`."""
     __tablename__ = "comments"
+    __table_args__ = (
+        # a post's comments, oldest first, straight off the index
+        Index("ix_comment_post_ts", "post_id", "timestamp"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    consultant_id = Column(Integer, ForeignKey("consultants.id"))
-    post_id = Column(Integer, ForeignKey("consultant_posts.id"))
-    comment_text = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)  # NULL for anonymous comments
+    post_id: Mapped[int] = mapped_column(ForeignKey("consultant_posts.id", ondelete="CASCADE"))
+    comment_text: Mapped[str] = mapped_column(Text)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=utcnow())
 
-    user = relationship("User", back_populates="comments")
-    consultant = relationship("Consultant", back_populates="comments")
-    post = relationship("ConsultantPost", back_populates="comments")
+    user: Mapped[Optional["User"]] = relationship(back_populates="comments")
+    post: Mapped["ConsultantPost"] = relationship(back_populates="comments")
 
 
 # ------------------------------
 # Followers Table
 # ------------------------------
 class Follower(Base):
+    """A (user, consultant) pair, keyed the same way as Like."""
     __tablename__ = "followers"
+    __table_args__ = (
+        Index("ix_follower_consultant", "consultant_id"),
+    )
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    consultant_id: Mapped[int] = mapped_column(ForeignKey("consultants.id", ondelete="CASCADE"), primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=utcnow())
+
+    user: Mapped["User"] = relationship(back_populates="following")
+    consultant: Mapped["Consultant"] = relationship(back_populates="followers")
+
+# ------------------------------
+# Timeline Table (fan-out on write)
+# ------------------------------
+class TimelineEntry(Base):
+    """One row per (follower, post): a user's "following" feed is a single index range scan."""
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        Index("ix_timeline_user_ts", "user_id", "timestamp"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    consultant_id = Column(Integer, ForeignKey("consultants.id"))
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey("consultant_posts.id", ondelete="CASCADE"), primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True))  # copy of the post's timestamp, for ordering
 
-    user = relationship("User", back_populates="following")
-    consultant = relationship("Consultant", back_populates="followers")
 
 # ------------------------------
 # Health Quiz Table
 # ------------------------------
 class HealthQuiz(Base):
     __tablename__ = "health_quizzes"
+    __table_args__ = (
+        # "which quizzes contain {...}" lookups (answers @> ...) on PostgreSQL
+        Index("ix_hq_answers_gin", "answers", postgresql_using="gin",
+              postgresql_ops={"answers": "jsonb_path_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)  # Who submitted the quiz
+    consultant_id: Mapped[Optional[int]] = mapped_column(ForeignKey("consultants.id", ondelete="SET NULL"), index=True)  # Optional: assigned consultant
+    answers: Mapped[dict] = mapped_column(JSON().with_variant(JSONB, "postgresql"))  # {"q1": ..., "q2": ..., "q3": ...}
+    image_key: Mapped[Optional[str]] = mapped_column(String(40))  # Optional uploaded image, see media_file()
+    recommendations: Mapped[Optional[str]] = mapped_column(Text)  # Gemini output; NULL while still generating
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=utcnow())
+
+    user: Mapped["User"] = relationship(back_populates="health_quizzes")
+    consultant: Mapped[Optional["Consultant"]] = relationship(back_populates="health_quizzes")
+
+
+# ------------------------------
+# Denormalized counters
+# ------------------------------
+# child model -> (parent model, child FK attribute, parent counter column)
+COUNTERS = {
+    Like: (ConsultantPost, "post_id", "like_count"),
+    Comment: (ConsultantPost, "post_id", "comment_count"),
+    Follower: (Consultant, "consultant_id", "follower_count"),
+}
+
+
+def bump_counter(connection, child_model, parent_id, delta: int):
+    """Add `delta` to the parent's counter for `child_model` in SQL (no read-modify-write)."""
+    if not delta or parent_id is None:
+        return
+    parent, _, counter = COUNTERS[child_model]
+    column = getattr(parent, counter)
+    connection.execute(update(parent).where(parent.id == parent_id).values({counter: column + delta}))
+
+
+def _register_counter(child_model, fk_attr):
+    # ORM inserts/deletes (session.add, cascades) keep the counters in step automatically;
+    # Core statements must call bump_counter themselves
+    @event.listens_for(child_model, "after_insert")
+    def _incr(mapper, connection, target):
+        bump_counter(connection, child_model, getattr(target, fk_attr), 1)
+
+    @event.listens_for(child_model, "after_delete")
+    def _decr(mapper, connection, target):
+        bump_counter(connection, child_model, getattr(target, fk_attr), -1)
+
+
+for _model, (_parent, _fk_attr, _counter) in COUNTERS.items():
+    _register_counter(_model, _fk_attr)
+
+
+# ------------------------------
+# Bulk inserts
+# ------------------------------
+BULK_INSERT_CHUNK = 10_000
+
+
+def bulk_insert(session, model, rows, chunk: int = BULK_INSERT_CHUNK):
+    """Insert a list of column dicts as batched Core INSERTs (no per-row ORM objects).
+
+    Use for imports/seeding instead of a session.add() loop. Core statements skip the
+    mapper events, so denormalized counters are bumped here once per parent, and each new
+    follow gets its timeline backfill; bulk-inserted posts are not fanned out to follower
+    timelines.
+    """
+    for i in range(0, len(rows), chunk):
+        session.execute(insert(model), rows[i:i + chunk])
+    if model is Follower:
+        for user_id, consultant_id in {(row.get("user_id"), row.get("consultant_id")) for row in rows}:
+            backfill_timeline(session.connection(), user_id, consultant_id)
+    if model in COUNTERS:
+        _, fk_attr, _ = COUNTERS[model]
+        per_parent = Counter(row.get(fk_attr) for row in rows)
+        for parent_id, n in per_parent.items():
+            bump_counter(session.connection(), model, parent_id, n)
+
+
+# ------------------------------
+# Timeline fan-out
+# ------------------------------
+# recent posts per followed consultant kept in a timeline, both on a new follow and by
+# migrate_db's backfill; the "following" feed shows one page of this many posts
+TIMELINE_BACKFILL = 50
+
+
+def _post_followers(post_id):
+    # (follower, post, post timestamp) rows for every follower of the post's author
+    return (
+        select(Follower.user_id, ConsultantPost.id, ConsultantPost.timestamp)
+        .join(ConsultantPost, ConsultantPost.consultant_id == Follower.consultant_id)
+        .where(ConsultantPost.id == post_id)
+    )
+
+
+def backfill_timeline(connection, user_id, consultant_id):
+    """Copy a consultant's recent posts into `user_id`'s timeline (after a follow)."""
+    if user_id is None:
+        return
+    recent = (
+        select(Follower.user_id, ConsultantPost.id, ConsultantPost.timestamp)
+        .join(ConsultantPost, ConsultantPost.consultant_id == Follower.consultant_id)
+        .where(Follower.user_id == user_id, Follower.consultant_id == consultant_id)
+        .order_by(ConsultantPost.timestamp.desc())
+        .limit(TIMELINE_BACKFILL)
+    )
+    connection.execute(insert(TimelineEntry).from_select(["user_id", "post_id", "timestamp"], recent))
+
+
+def drop_timeline(connection, user_id, consultant_id):
+    """Remove a consultant's posts from `user_id`'s timeline (after an unfollow)."""
+    if user_id is None:
+        return
+    posts = select(ConsultantPost.id).where(ConsultantPost.consultant_id == consultant_id)
+    connection.execute(delete(TimelineEntry).where(TimelineEntry.user_id == user_id, TimelineEntry.post_id.in_(posts)))
+
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))  # Who submitted the quiz
-    consultant_id = Column(Integer, ForeignKey("consultants.id"), nullable=True)  # Optional: assigned consultant
-    question_1 = Column(Text, nullable=False)
-    question_2 = Column(Text, nullable=False)
-    question_3 = Column(Text, nullable=True)
-    image_path = Column(String, nullable=True)  # Optional uploaded image
-    timestamp = Column(DateTime, default=datetime.utcnow)
+@event.listens_for(ConsultantPost, "after_insert")
+def _fan_out_post(mapper, connection, target):
+    # one set-based INSERT ... SELECT instead of a row per follower
+    connection.execute(insert(TimelineEntry).from_select(["user_id", "post_id", "timestamp"], _post_followers(target.id)))
 
-    user = relationship("User", backref="health_quizzes")
-    consultant = relationship("Consultant", backref="health_quizzes")
 
+@event.listens_for(ConsultantPost, "after_update")
+def _retime_post(mapper, connection, target):
+    # edits bump the post's timestamp; keep timeline ordering in step
+    post_ts = select(ConsultantPost.timestamp).where(ConsultantPost.id == target.id).scalar_subquery()
+    connection.execute(update(TimelineEntry).where(TimelineEntry.post_id == target.id).values(timestamp=post_ts))
+# deleted posts leave the timelines through timeline_entries' ON DELETE CASCADE
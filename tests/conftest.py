@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# point the app at a throwaway SQLite file before database.py builds its engine
+_db_dir = tempfile.mkdtemp(prefix="mediai-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.chdir(ROOT)  # templates/ and static/ are looked up relative to the working directory
+sys.path.insert(0, ROOT)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as mediai  # noqa: E402
+from database import engine  # noqa: E402
+
+
+@pytest.fixture
+def count_queries():
+    """`with count_queries() as n:` ... `n.count` is the number of SQL statements sent meanwhile."""
+    @contextmanager
+    def counting():
+        counter = type("QueryCounter", (), {"count": 0})()
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            counter.count += 1
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield counter
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return counting
+
+
+@pytest.fixture(scope="session")
+def clients():
+    """(user, consultant) TestClients over a small feed: 3 consultants x 3 posts, likes,
+    comments and follows, so per-row lazy loads would show up as extra queries."""
+    consultants = []
+    for i in range(3):
+        c = TestClient(mediai.app)
+        c.post("/consultant_register", data={"name": f"Dr {i}", "email": f"dr{i}@example.com",
+                                             "specialization": "derm", "bio": f"bio {i}"})
+        for j in range(3):
+            c.post("/consultant_post", data={"content": f"post {i}.{j}"})
+        consultants.append(c)
+    user = TestClient(mediai.app)
+    user.post("/signup", data={"email": "user@example.com", "password": "pw"})
+    user.post("/login", data={"email": "user@example.com", "password": "pw"})
+    for consultant_id in (1, 2):
+        user.post(f"/consultant/{consultant_id}/follow")
+    for post_id in (1, 2, 4):
+        user.post(f"/post/{post_id}/like")
+        user.post(f"/post/{post_id}/comment", data={"comment_text": "thanks"})
+    return user, consultants[0]
@@ -0,0 +1,29 @@
+"""Each page runs a fixed number of queries, however many posts, likes or comments it shows.
+
+Relationships are lazy="raise" / "raise_on_sql", so a template touching an unloaded
+relationship fails here instead of issuing one query per row.
+"""
+import pytest
+
+# user lookup, ETag version, consultant rows for the ETag, the page itself, liked / followed sets
+FEED_QUERIES = 6
+
+PAGES = [
+    ("user", "/consultants", FEED_QUERIES),
+    ("user", "/consultants?following=true", FEED_QUERIES),
+    # user, ETag version, posts, their comments (selectinload), followed / liked sets
+    ("user", "/consultant/1", 6),
+    # the consultant and their posts
+    ("consultant", "/consultant_post", 2),
+]
+
+
+@pytest.mark.parametrize("who, url, expected", PAGES)
+def test_query_count(clients, count_queries, who, url, expected):
+    user, consultant = clients
+    client = user if who == "user" else consultant
+    client.get(url)  # warm the consultant cache, so the count does not depend on test order
+    with count_queries() as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert queries.count == expected